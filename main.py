@@ -1,14 +1,33 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Depends, Response, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, BigInteger, Boolean, Text, TIMESTAMP, ARRAY
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
-from sqlalchemy.sql import func
+from fastapi.responses import FileResponse, ORJSONResponse
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import select, update, delete, Column, Integer, String, BigInteger, Boolean, Text, TIMESTAMP, ARRAY, Index
+from sqlalchemy.orm import declarative_base, raiseload
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
+from sqlalchemy.sql import func, text
+from typing import List, Optional
 from urllib.parse import quote_plus
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image as PILImage, ImageOps
 import os
 from datetime import datetime
+import io
+import re
+import sys
+import hashlib
 import uuid
+import asyncio
+import multiprocessing
+import time
+import orjson
 from dotenv import load_dotenv
 
 # Cargar variables de entorno solo en desarrollo local
@@ -29,25 +48,89 @@ if missing_vars:
     print(f"Advertencia: Variables de entorno faltantes: {missing_vars}")
     print("Usando valores por defecto...")
 
+# Tamaño del pool de conexiones (se crea una sola vez al importar el módulo).
+# Cada worker de uvicorn tiene su propio pool, así que tanto DB_MAX_CONNECTIONS
+# como las conexiones extra para picos de carga (DB_MAX_OVERFLOW) se reparten
+# entre los WEB_CONCURRENCY workers: el máximo total contra PostgreSQL es
+# DB_MAX_CONNECTIONS + DB_MAX_OVERFLOW, con dos excepciones:
+#   - cada worker tiene al menos una conexión, así que con más workers que
+#     DB_MAX_CONNECTIONS el pool suma WEB_CONCURRENCY conexiones;
+#   - DB_POOL_SIZE, si se define, es el tamaño por worker y no se reparte:
+#     el pool suma WEB_CONCURRENCY * DB_POOL_SIZE conexiones
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 20))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", max(1, DB_MAX_CONNECTIONS // WEB_CONCURRENCY)))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_OVERFLOW = DB_MAX_OVERFLOW // WEB_CONCURRENCY
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Con PgBouncer delante (normalmente en el puerto 6432) el pooling lo hace
+# PgBouncer y la aplicación no debe mantener un segundo pool
+DB_USE_PGBOUNCER = os.getenv("DB_USE_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
 # Codificar la contraseña para la URL
 ENCODED_PASSWORD = quote_plus(DB_PASSWORD)
 
-# Cadena de conexión a PostgreSQL SIN SSL
-DATABASE_URL = f"postgresql://{DB_USER}:{ENCODED_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?sslmode=disable"
+# Con PgBouncer se desactiva la caché de sentencias preparadas de SQLAlchemy
+# (ver ENGINE_OPTIONS más abajo para el resto de ajustes que necesita)
+DATABASE_URL_QUERY = "?prepared_statement_cache_size=0" if DB_USE_PGBOUNCER else ""
+
+# Cadena de conexión a PostgreSQL con el driver asíncrono asyncpg (el SSL se
+# desactiva en connect_args: asyncpg no entiende el parámetro sslmode)
+DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{ENCODED_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}{DATABASE_URL_QUERY}"
+# Versión sin contraseña para mostrar en /config y en los logs
+DATABASE_URL_MASKED = f"postgresql+asyncpg://{DB_USER}:******@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# El entorno no cambia mientras el proceso está vivo: resolverlo una sola vez
+ENVIRONMENT = "production" if os.getenv("RENDER") else "development"
+
+# Opciones comunes del engine. Cada petición ejecuta una sola sentencia de
+# escritura, así que se trabaja en AUTOCOMMIT: sin BEGIN/COMMIT por petición y
+# sin ROLLBACK al devolver la conexión al pool
+ENGINE_OPTIONS = {
+    "isolation_level": "AUTOCOMMIT",
+    "connect_args": {"ssl": False},
+}
+if DB_USE_PGBOUNCER:
+    # PgBouncer en modo transacción reparte cada transacción entre sus
+    # conexiones al servidor, y el dialecto asyncpg siempre prepara sentencias
+    # con nombre. Para que preparar y ejecutar caigan en la misma conexión:
+    #   - sin AUTOCOMMIT, para que el BEGIN fije la conexión del servidor
+    #     durante toda la transacción;
+    #   - nombres únicos por sentencia, para que no choquen entre conexiones;
+    #   - sin las cachés de sentencias de SQLAlchemy y de asyncpg.
+    del ENGINE_OPTIONS["isolation_level"]
+    ENGINE_OPTIONS["poolclass"] = NullPool
+    ENGINE_OPTIONS["connect_args"].update(
+        statement_cache_size=0,
+        prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4().hex}__",
+    )
+else:
+    ENGINE_OPTIONS.update(
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_POOL_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        pool_reset_on_return=None,
+    )
 
-# Configuración de SQLAlchemy SIN SSL
+# Configuración de SQLAlchemy SIN SSL. Con el engine asíncrono las consultas no
+# ocupan un hilo del threadpool: el event loop atiende otras peticiones mientras
+# espera a PostgreSQL
 try:
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True, connect_args={'sslmode': 'disable'})
-    SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    engine = create_async_engine(DATABASE_URL, **ENGINE_OPTIONS)
+    SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
     Base = declarative_base()
     print(f"✅ Conectado a la base de datos: {DB_NAME} en {DB_HOST}:{DB_PORT} (sin SSL)")
 except Exception as e:
     print(f"❌ Error conectando a la base de datos: {e}")
     # Intentar conexión alternativa sin puerto específico
     try:
-        DATABASE_URL_FALLBACK = f"postgresql://{DB_USER}:{ENCODED_PASSWORD}@{DB_HOST}/{DB_NAME}?sslmode=disable"
-        engine = create_engine(DATABASE_URL_FALLBACK, pool_pre_ping=True, connect_args={'sslmode': 'disable'})
-        SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+        DATABASE_URL_FALLBACK = f"postgresql+asyncpg://{DB_USER}:{ENCODED_PASSWORD}@{DB_HOST}/{DB_NAME}{DATABASE_URL_QUERY}"
+        engine = create_async_engine(DATABASE_URL_FALLBACK, **ENGINE_OPTIONS)
+        SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
         Base = declarative_base()
         print(f"✅ Conectado a la base de datos usando puerto default 5432 (sin SSL)")
     except Exception as e2:
@@ -57,6 +140,10 @@ except Exception as e:
 # Modelo de la base de datos para imágenes
 class Image(Base):
     __tablename__ = "images"
+    # Cubre los filtros del listado (user_id, is_public) y su orden por id
+    __table_args__ = (
+        Index("ix_images_user_public_id", "user_id", "is_public", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     filename = Column(String(255), nullable=False)
@@ -75,13 +162,48 @@ class Image(Base):
     user_id = Column(String(100))
     device_info = Column(Text)
     app_version = Column(String(50))
+    content_hash = Column(String(64), index=True)
 
-# Crear las tablas en la base de datos
-try:
-    Base.metadata.create_all(bind=engine)
-    print("✅ Tablas de la base de datos creadas/verificadas correctamente")
-except Exception as e:
-    print(f"❌ Error creando tablas: {e}")
+# Columnas que devuelve el listado, en el mismo orden que ImageListItemSchema.
+# Se consultan como tuplas para no materializar objetos ORM por fila y se
+# omiten las columnas de texto largo que el listado no necesita.
+IMAGE_LIST_COLUMNS = (
+    Image.id, Image.filename, Image.original_filename, Image.file_size, Image.mime_type,
+    Image.width, Image.height, Image.upload_date, Image.file_path, Image.thumbnail_path,
+    Image.is_public, Image.user_id,
+)
+
+# Crear las tablas en la base de datos una sola vez al arrancar, reintentando
+# con espera exponencial mientras la base de datos no esté disponible
+DB_STARTUP_RETRIES = int(os.getenv("DB_STARTUP_RETRIES", 5))
+
+def create_schema(connection):
+    """Crea tablas, columnas e índices (recibe la conexión síncrona de run_sync)"""
+    Base.metadata.create_all(bind=connection)
+    # Columnas añadidas después de crear la tabla original
+    connection.execute(text("ALTER TABLE images ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"))
+    # create_all no añade índices nuevos a una tabla que ya existe
+    for index in Image.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
+
+@asynccontextmanager
+async def lifespan(app):
+    delay = 1
+    for attempt in range(1, DB_STARTUP_RETRIES + 1):
+        try:
+            async with engine.begin() as connection:
+                await connection.run_sync(create_schema)
+            print("✅ Tablas de la base de datos creadas/verificadas correctamente")
+            break
+        except Exception as e:
+            print(f"❌ Error creando tablas (intento {attempt}/{DB_STARTUP_RETRIES}): {e}")
+            if attempt < DB_STARTUP_RETRIES:
+                await asyncio.sleep(delay)
+                delay *= 2
+    yield
+    if _thumbnail_pool is not None:
+        _thumbnail_pool.shutdown()
+    await engine.dispose()
 
 # Esquemas Pydantic
 class ImageSchema(BaseModel):
@@ -89,19 +211,35 @@ class ImageSchema(BaseModel):
     original_filename: str
     file_size: int
     mime_type: str
-    width: int = None
-    height: int = None
+    width: Optional[int] = None
+    height: Optional[int] = None
     file_path: str
-    thumbnail_path: str = None
-    description: str = None
-    tags: list = []
+    thumbnail_path: Optional[str] = None
+    description: Optional[str] = None
+    tags: Optional[list] = []
     is_public: bool = False
-    user_id: str = None
-    device_info: str = None
-    app_version: str = None
+    user_id: Optional[str] = None
+    device_info: Optional[str] = None
+    app_version: Optional[str] = None
 
-    class Config:
-        from_attributes = True  # Cambiado de orm_mode a from_attributes
+    model_config = ConfigDict(from_attributes=True)
+
+# Versión reducida para el listado: sin descripción, tags ni datos del dispositivo
+class ImageListItemSchema(BaseModel):
+    id: int
+    filename: str
+    original_filename: str
+    file_size: int
+    mime_type: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    upload_date: datetime
+    file_path: str
+    thumbnail_path: Optional[str] = None
+    is_public: bool
+    user_id: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
 
 class ImageResponseSchema(BaseModel):
     id: int
@@ -109,75 +247,492 @@ class ImageResponseSchema(BaseModel):
     original_filename: str
     file_size: int
     mime_type: str
-    width: int = None
-    height: int = None
+    width: Optional[int] = None
+    height: Optional[int] = None
     upload_date: datetime
     last_modified: datetime
     file_path: str
-    thumbnail_path: str = None
-    description: str = None
-    tags: list = []
+    thumbnail_path: Optional[str] = None
+    description: Optional[str] = None
+    tags: Optional[list] = []
     is_public: bool
-    user_id: str = None
-    device_info: str = None
-    app_version: str = None
+    user_id: Optional[str] = None
+    device_info: Optional[str] = None
+    app_version: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
 
-    class Config:
-        from_attributes = True  # Cambiado de orm_mode a from_attributes
+class BulkDeleteSchema(BaseModel):
+    ids: List[int]
 
 # Instancia de la aplicación FastAPI
 app = FastAPI(
     title="Photo Picker API", 
     version="1.0.0",
-    description="API para subir y gestionar imágenes desde aplicaciones Android"
+    description="API para subir y gestionar imágenes desde aplicaciones Android",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# Configuración de CORS
-origins = ["*"]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Configuración de CORS. Sin CORS_ORIGIN_REGEX se acepta cualquier origen pero
+# sin credenciales (el estándar no permite "*" junto con credenciales); con
+# CORS_ORIGIN_REGEX solo se aceptan los orígenes que coinciden con el patrón.
+# Métodos y cabeceras se listan explícitamente en lugar de usar comodines.
+CORS_ORIGIN_REGEX = os.getenv("CORS_ORIGIN_REGEX")
+cors_options = {
+    "allow_methods": ["GET", "POST", "PUT", "DELETE"],
+    "allow_headers": ["Authorization", "Content-Type"],
+    "expose_headers": ["X-Next-Cursor"],
+}
+if CORS_ORIGIN_REGEX:
+    app.add_middleware(CORSMiddleware, allow_origin_regex=CORS_ORIGIN_REGEX, allow_credentials=True, **cors_options)
+else:
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], **cors_options)
 
 # Directorios desde variables de entorno
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "thumbnails")
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB por bloque al copiar subidas a disco
+
+# Miniaturas: se generan después de responder, en procesos aparte para que
+# Pillow no bloquee el event loop ni compita por el GIL. Los núcleos se reparten
+# entre los WEB_CONCURRENCY workers, igual que las conexiones a la base de datos
+THUMBNAIL_SIZE = (256, 256)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+
+# Caché en memoria (por proceso) del listado de imágenes. Una escritura solo la
+# invalida en el worker que la atendió, así que con varios workers viene
+# desactivada (TTL 0): los demás seguirían sirviendo el listado anterior
+IMAGES_CACHE_TTL = int(os.getenv("IMAGES_CACHE_TTL", 30 if WEB_CONCURRENCY == 1 else 0))
+IMAGES_CACHE_MAX_ENTRIES = 256
+# Tiempo que el cliente puede reutilizar un listado sin volver a pedirlo
+IMAGES_LIST_MAX_AGE = int(os.getenv("IMAGES_LIST_MAX_AGE", 30))
+
+# Consulta de verificación de /health, construida una sola vez
+_PING = text("SELECT 1")
+
+# Separador de tags: la coma y los espacios que la rodean se eliminan en una
+# sola pasada del motor de expresiones regulares
+_TAG_SPLIT = re.compile(r"\s*,\s*")
+
+# Máximo de imágenes por petición de borrado masivo (límite de delete_objects de S3)
+BULK_DELETE_MAX = 1000
+
+# Tipos de imagen aceptados en las subidas, con la extensión que se usa cuando
+# el nombre original no trae una extensión de imagen conocida
+ALLOWED_MIME_TYPES = frozenset({"image/jpeg", "image/png", "image/gif", "image/webp", "image/jpg"})
+ALLOWED_EXTENSIONS = frozenset({"jpg", "jpeg", "png", "gif", "webp"})
+MIME_EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+# Subida directa a S3 (opcional): con S3_BUCKET definido el cliente pide una URL
+# prefirmada, sube la imagen directamente al bucket y luego solo registra los
+# metadatos, sin que los bytes pasen por este proceso
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_REGION = os.getenv("S3_REGION")
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL") or f"https://{S3_BUCKET}.s3.amazonaws.com"
+S3_UPLOAD_EXPIRES = int(os.getenv("S3_UPLOAD_EXPIRES", 900))
+S3_MAX_UPLOAD_SIZE = int(os.getenv("S3_MAX_UPLOAD_SIZE", 20 * 1024 * 1024))
+
+s3_client = None
+if S3_BUCKET:
+    import boto3
+    from botocore.exceptions import ClientError
+    s3_client = boto3.client("s3", region_name=S3_REGION)
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(THUMBNAIL_DIR, exist_ok=True)
 
-# Servir archivos estáticos
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
-app.mount("/thumbnails", StaticFiles(directory=THUMBNAIL_DIR), name="thumbnails")
+# Respuesta de archivo que usa la extensión ASGI "http.response.pathsend" cuando
+# el servidor la anuncia: el servidor envía el archivo con sendfile(2) en lugar
+# de leerlo por bloques desde Python
+class PathSendFileResponse(FileResponse):
+    async def __call__(self, scope, receive, send):
+        if (
+            "http.response.pathsend" not in scope.get("extensions", {})
+            or self.send_header_only
+            or self.stat_result is None
+        ):
+            await super().__call__(scope, receive, send)
+            return
+
+        # Tipo MIME y tamaño ya vienen calculados del stat hecho por StaticFiles
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        await send({"type": "http.response.pathsend", "path": os.fspath(self.path)})
+        if self.background is not None:
+            await self.background()
+
+class MediaStaticFiles(StaticFiles):
+    """StaticFiles que sirve las imágenes con PathSendFileResponse"""
+
+    # Los archivos se guardan con un nombre uuid único y nunca se sobrescriben,
+    # así que navegadores y CDN pueden cachearlos indefinidamente
+    cache_control = "public, max-age=31536000, immutable"
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = PathSendFileResponse(
+            full_path,
+            status_code=status_code,
+            headers={"Cache-Control": self.cache_control},
+            stat_result=stat_result,
+            method=scope["method"]
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+# Servir archivos estáticos. En producción conviene que los sirva nginx con
+# sendfile y desactivar estos montajes con SERVE_STATIC=false, por ejemplo:
+#
+#   location /uploads/    { alias /app/uploads/;    sendfile on; tcp_nopush on; aio threads; }
+#   location /thumbnails/ { alias /app/thumbnails/; sendfile on; tcp_nopush on; aio threads; }
+SERVE_STATIC = os.getenv("SERVE_STATIC", "true").lower() in ("1", "true", "yes")
+if SERVE_STATIC:
+    app.mount("/uploads", MediaStaticFiles(directory=UPLOAD_DIR), name="uploads")
+    app.mount("/thumbnails", MediaStaticFiles(directory=THUMBNAIL_DIR), name="thumbnails")
 
 # Dependencia para obtener la sesión de la base de datos
-def get_db():
-    db = SessionLocal()
-    try:
+# La sesión toma una conexión del pool del engine y la devuelve al cerrarse,
+# incluso si el endpoint lanza una excepción
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+async def query_image(db, image_id):
+    """Carga una imagen por id; cualquier carga perezosa accidental lanza un error"""
+    return await db.scalar(select(Image).options(raiseload("*")).where(Image.id == image_id))
+
+def parse_tags(tags):
+    """Convierte "a, b,c" en ["a", "b", "c"]; una cadena vacía o en blanco en []"""
+    tags = tags.strip() if tags else ""
+    return _TAG_SPLIT.split(tags) if tags else []
+
+def make_unique_filename(original_filename, content_type):
+    """Genera un nombre único (uuid4 en hexadecimal) con una extensión de imagen válida"""
+    extension = ""
+    if original_filename and "." in original_filename:
+        extension = original_filename.rpartition(".")[2].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        extension = MIME_EXTENSIONS[content_type]
+    return f"{uuid.uuid4().hex}.{extension}"
+
+def in_memory_upload(src):
+    """Indica si la subida sigue en el BytesIO interno del SpooledTemporaryFile"""
+    return not getattr(src, "_rolled", True) and isinstance(getattr(src, "_file", None), io.BytesIO)
+
+def open_upload_target(file_path):
+    """Abre el destino de una subida; devuelve el descriptor y si es un inodo anónimo.
+
+    En Linux se usa O_TMPFILE: el archivo no tiene nombre hasta que se enlaza al
+    terminar la copia, así que una subida interrumpida no deja archivos a medias.
+    """
+    try:
+        fd = os.open(os.path.dirname(file_path) or ".", os.O_TMPFILE | os.O_WRONLY, 0o644)
+        return fd, True
+    except (AttributeError, OSError):
+        # Sin soporte de O_TMPFILE (otro sistema operativo o sistema de archivos)
+        return os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), False
+
+def save_upload_file(src, file_path):
+    """Copia el archivo subido a disco y devuelve el número de bytes escritos"""
+    written = 0
+    src.seek(0)
+    fd, anonymous = open_upload_target(file_path)
+    with open(fd, "wb") as out:
+        # Si Starlette ya volcó la subida a un temporal en disco, copiar
+        # directamente en el kernel con sendfile(2). Solo en Linux: en macOS
+        # sendfile solo escribe en sockets (mismo criterio que shutil)
+        if getattr(src, "_rolled", False) and sys.platform.startswith("linux"):
+            src_fd = src.fileno()
+            out_fd = out.fileno()
+            while True:
+                sent = os.sendfile(out_fd, src_fd, written, UPLOAD_CHUNK_SIZE)
+                if sent == 0:
+                    break
+                written += sent
+        # Subida pequeña que sigue en memoria: escribir su buffer tal cual,
+        # sin copiarlo antes a bloques intermedios
+        elif in_memory_upload(src):
+            with src._file.getbuffer() as view:
+                out.write(view)
+                written = view.nbytes
+        else:
+            while True:
+                chunk = src.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                out.write(chunk)
+                written += len(chunk)
+        
+        # Dar nombre al inodo anónimo solo cuando la copia terminó bien.
+        # os.link solo llama a linkat(AT_SYMLINK_FOLLOW), necesario para enlazar
+        # a través de /proc/self/fd, si recibe un dir_fd; con una ruta de origen
+        # absoluta el kernel ignora ese dir_fd
+        if anonymous:
+            out.flush()
+            os.link(f"/proc/self/fd/{fd}", file_path, src_dir_fd=fd)
+    return written
+
+def unlink_quiet(path):
+    """Elimina un archivo ignorando que ya no exista (un solo syscall, sin exists previo)"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def stash_file(path):
+    """Aparta un archivo que se va a borrar; devuelve su nombre temporal o None si no existía"""
+    stashed = f"{path}.{uuid.uuid4().hex}.deleted"
+    try:
+        os.rename(path, stashed)
+    except FileNotFoundError:
+        return None
+    return stashed
+
+def restore_duplicate_files(src, filename, thumbnail_path):
+    """Comprueba que los archivos que reutiliza una subida duplicada sigan en disco.
+
+    Si falta la imagen (disco efímero tras un redeploy, o borrado concurrente de
+    la original) se vuelve a escribir desde la subida. Devuelve la miniatura a
+    reutilizar, o None si también falta y hay que regenerarla.
+    """
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.exists(file_path):
+        try:
+            save_upload_file(src, file_path)
+        except FileExistsError:
+            # Otra subida o el propio borrado ya la devolvió a su sitio
+            pass
+    if thumbnail_path and not os.path.exists(os.path.join(THUMBNAIL_DIR, os.path.basename(thumbnail_path))):
+        return None
+    return thumbnail_path
+
+def hash_upload(src):
+    """Calcula el hash BLAKE2b del archivo subido"""
+    hasher = hashlib.blake2b(digest_size=16)
+    if in_memory_upload(src):
+        with src._file.getbuffer() as view:
+            hasher.update(view)
+    else:
+        src.seek(0)
+        while True:
+            chunk = src.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+async def find_duplicate_upload(db, src):
+    """Busca una imagen con el mismo contenido que el archivo subido"""
+    # Leer y hashear el archivo en un hilo para no bloquear el event loop
+    content_hash = await run_in_threadpool(hash_upload, src)
+    result = await db.execute(
+        select(Image.filename, Image.file_size, Image.thumbnail_path, Image.width, Image.height)
+        .where(Image.content_hash == content_hash)
+        .limit(1)
+    )
+    return content_hash, result.first()
+
+_thumbnail_pool = None
+
+def get_thumbnail_pool():
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        # Sin fork: el worker de uvicorn ya tiene hilos del threadpool y sockets
+        # de asyncpg abiertos, y hacer fork de un proceso con hilos puede dejar
+        # al hijo bloqueado en un lock que nunca se libera
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _thumbnail_pool = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context(method)
+        )
+    return _thumbnail_pool
+
+def reset_thumbnail_pool(pool):
+    """Descarta un pool roto; el siguiente get_thumbnail_pool crea uno nuevo"""
+    global _thumbnail_pool
+    if _thumbnail_pool is pool:
+        _thumbnail_pool = None
+    pool.shutdown(wait=False)
+
+def make_thumbnail(src, dst):
+    """Genera la miniatura de una imagen y devuelve el tamaño original (corre en otro proceso)"""
+    with PILImage.open(src) as img:
+        # Las cámaras Android suelen guardar la rotación en la etiqueta EXIF
+        # Orientation en lugar de girar los píxeles: aplicarla antes de medir
+        img = ImageOps.exif_transpose(img)
+        size = img.size
+        img.thumbnail(THUMBNAIL_SIZE)
+        if dst.endswith((".jpg", ".jpeg")) and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(dst)
+    return size
+
+async def save_thumbnail_record(image_id, thumbnail_path, width, height):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(Image)
+            .where(Image.id == image_id)
+            .values(thumbnail_path=thumbnail_path, width=width, height=height)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    invalidate_images_cache()
+
+async def filenames_in_use(db, filenames):
+    """Devuelve cuáles de los nombres de archivo siguen usando alguna imagen"""
+    if not filenames:
+        return set()
+    return set(await db.scalars(select(Image.filename).where(Image.filename.in_(filenames))))
+
+async def delete_image_records(db, ids):
+    """Borra varias imágenes en un solo DELETE y devuelve las rutas a limpiar"""
+    result = await db.execute(
+        delete(Image)
+        .where(Image.id.in_(ids))
+        .returning(Image.filename, Image.file_path, Image.thumbnail_path)
+    )
+    rows = result.all()
+    await db.commit()
+    
+    local_files = []
+    s3_urls = set()
+    for row in rows:
+        if s3_client is not None and row.file_path.startswith(f"{S3_PUBLIC_URL}/"):
+            s3_urls.add(row.file_path)
+        else:
+            local_files.append((row.filename, os.path.join(UPLOAD_DIR, row.filename)))
+            if row.thumbnail_path:
+                local_files.append((row.filename, os.path.join(THUMBNAIL_DIR, os.path.basename(row.thumbnail_path))))
+    
+    # Archivos que otras imágenes con el mismo contenido siguen usando: esos no
+    # se tocan nunca
+    filenames = {filename for filename, _ in local_files}
+    still_used = await filenames_in_use(db, filenames)
+    unused = [(filename, path) for filename, path in local_files if filename not in still_used]
+    
+    # El resto se aparta y se vuelve a comprobar: una subida duplicada
+    # registrada entre las dos consultas hace que se devuelvan a su sitio, y una
+    # registrada después ya no los encuentra y escribe una copia nueva
+    # (restore_duplicate_files)
+    stashed = await run_in_threadpool(
+        lambda: [(filename, path, stash_file(path)) for filename, path in unused]
+    )
+    stashed = [entry for entry in stashed if entry[2] is not None]
+    try:
+        now_used = await filenames_in_use(db, {filename for filename, _, _ in stashed})
+    except Exception:
+        # Sin poder comprobarlo, devolver todos los archivos a su sitio
+        await run_in_threadpool(lambda: [os.replace(tmp, path) for _, path, tmp in stashed])
+        raise
+    
+    restore = [(tmp, path) for filename, path, tmp in stashed if filename in now_used]
+    if restore:
+        await run_in_threadpool(lambda: [os.replace(tmp, path) for tmp, path in restore])
+    
+    paths = [tmp for filename, _, tmp in stashed if filename not in now_used]
+    
+    # Un objeto de S3 registrado dos veces no se borra mientras quede otra fila
+    if s3_urls:
+        s3_urls -= set(await db.scalars(select(Image.file_path).where(Image.file_path.in_(s3_urls))))
+    s3_keys = [url[len(S3_PUBLIC_URL) + 1:] for url in s3_urls]
+    return len(rows), paths, s3_keys
+
+async def generate_thumbnail(image_id, filename):
+    """Tarea en segundo plano: crea la miniatura y actualiza el registro de la imagen"""
+    src = os.path.join(UPLOAD_DIR, filename)
+    dst = os.path.join(THUMBNAIL_DIR, filename)
+    loop = asyncio.get_running_loop()
+    pool = get_thumbnail_pool()
+    try:
+        width, height = await loop.run_in_executor(pool, make_thumbnail, src, dst)
+        await save_thumbnail_record(image_id, f"/thumbnails/{filename}", width, height)
+    except BrokenProcessPool as e:
+        # Un proceso del pool murió (segfault, OOM con una imagen enorme) y el
+        # pool ya no acepta tareas: descartarlo para que la próxima lo recree
+        print(f"❌ Error generando miniatura de {filename}: {e}")
+        reset_thumbnail_pool(pool)
+    except Exception as e:
+        print(f"❌ Error generando miniatura de {filename}: {e}")
+
+async def save_image_record(db, db_image):
+    """Inserta el registro de la imagen"""
+    # El INSERT ya trae id y fechas generadas por la BD mediante RETURNING y la
+    # sesión no expira los atributos al hacer commit: no hace falta un refresh
+    db.add(db_image)
+    await db.commit()
+
+# El listado se guarda ya serializado, indexado por versión + parámetros.
+# Cada escritura incrementa la versión, así que un listado calculado mientras
+# se subía una imagen nunca se guarda con datos viejos.
+_images_cache = {}
+_images_cache_version = 0
+
+def get_cached_images(key):
+    entry = _images_cache.get((_images_cache_version,) + key)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    return entry[1]
+
+def set_cached_images(version, key, value):
+    if version != _images_cache_version or IMAGES_CACHE_TTL <= 0:
+        return
+    if len(_images_cache) >= IMAGES_CACHE_MAX_ENTRIES:
+        _images_cache.clear()
+    _images_cache[(version,) + key] = (time.monotonic() + IMAGES_CACHE_TTL, value)
+
+def invalidate_images_cache():
+    global _images_cache_version
+    _images_cache_version += 1
+    _images_cache.clear()
+
+# Respuestas de /, /config y /test-upload: su contenido no cambia mientras el
+# proceso está vivo, así que se serializan una sola vez al importar el módulo
+_ROOT_BODY = orjson.dumps({
+    "message": "Photo Picker API está funcionando correctamente",
+    "database": DB_NAME,
+    "host": DB_HOST,
+    "port": DB_PORT,
+    "ssl_mode": "disabled",
+    "status": "active"
+})
+_CONFIG_BODY = orjson.dumps({
+    "db_host": DB_HOST,
+    "db_port": DB_PORT,
+    "db_name": DB_NAME,
+    "db_user": DB_USER,
+    "upload_dir": UPLOAD_DIR,
+    "thumbnail_dir": THUMBNAIL_DIR,
+    "ssl_mode": "disabled",
+    "database_url": DATABASE_URL_MASKED
+})
+_TEST_UPLOAD_BODY = orjson.dumps({
+    "status": "upload_endpoint_available",
+    "method": "POST",
+    "endpoint": "/upload",
+    "required_fields": ["file (image)"],
+    "optional_fields": ["user_id", "description", "tags", "is_public", "device_info", "app_version"]
+})
 
 # Rutas de la API
 @app.get("/")
-def read_root():
-    return {
-        "message": "Photo Picker API está funcionando correctamente",
-        "database": DB_NAME,
-        "host": DB_HOST,
-        "port": DB_PORT,
-        "ssl_mode": "disabled",
-        "status": "active"
-    }
+async def read_root():
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
 @app.get("/health")
-def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_db)):
     """Endpoint para verificar que la API y la base de datos están funcionando"""
     try:
         # Intentar una consulta simple para verificar la conexión a la base de datos
-        db.execute("SELECT 1")
+        await db.execute(_PING)
         
         # Verificar directorios
         upload_dir_exists = os.path.exists(UPLOAD_DIR)
@@ -196,67 +751,71 @@ def health_check(db: Session = Depends(get_db)):
                 "path": UPLOAD_DIR
             },
             "timestamp": datetime.now().isoformat(),
-            "environment": "production" if os.getenv("RENDER") else "development"
+            "environment": ENVIRONMENT
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error de conexión a la base de datos: {str(e)}")
 
 @app.get("/config")
-def show_config():
+async def show_config():
     """Endpoint para mostrar la configuración actual (útil para debugging)"""
-    return {
-        "db_host": DB_HOST,
-        "db_port": DB_PORT,
-        "db_name": DB_NAME,
-        "db_user": DB_USER,
-        "upload_dir": UPLOAD_DIR,
-        "thumbnail_dir": THUMBNAIL_DIR,
-        "ssl_mode": "disabled",
-        "database_url": f"postgresql://{DB_USER}:******@{DB_HOST}:{DB_PORT}/{DB_NAME}?sslmode=disable"
-    }
+    return Response(content=_CONFIG_BODY, media_type="application/json")
 
 @app.get("/test-upload")
 async def test_upload_endpoint():
     """Endpoint para probar que el upload funciona"""
-    return {
-        "status": "upload_endpoint_available",
-        "method": "POST",
-        "endpoint": "/upload",
-        "required_fields": ["file (image)"],
-        "optional_fields": ["user_id", "description", "tags", "is_public", "device_info", "app_version"]
-    }
+    return Response(content=_TEST_UPLOAD_BODY, media_type="application/json")
 
-@app.get("/images/")
-def get_images(
+@app.get("/images/", response_model=List[ImageListItemSchema])
+async def get_images(
     skip: int = 0, 
     limit: int = 100, 
+    before: int = None,
     user_id: str = None, 
     is_public: bool = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    query = db.query(Image)
-    
-    if user_id:
-        query = query.filter(Image.user_id == user_id)
-    
-    if is_public is not None:
-        query = query.filter(Image.is_public == is_public)
-    
-    images = query.offset(skip).limit(limit).all()
+    """Endpoint para listar las imágenes, de la más reciente a la más antigua"""
+    cache_key = (skip, limit, before, user_id, is_public)
+    cached = get_cached_images(cache_key)
+    if cached is None:
+        version = _images_cache_version
+        query = select(*IMAGE_LIST_COLUMNS)
+        
+        # Paginación por clave: `before` es el X-Next-Cursor de la página anterior
+        # y evita el recorrido lineal de OFFSET
+        if before is not None:
+            query = query.where(Image.id < before)
+        
+        if user_id:
+            query = query.where(Image.user_id == user_id)
+        
+        if is_public is not None:
+            query = query.where(Image.is_public == is_public)
+        
+        result = await db.execute(query.order_by(Image.id.desc()).offset(skip).limit(limit))
+        rows = result.all()
+        
+        next_cursor = str(rows[-1].id) if rows and len(rows) == limit else None
+        cached = (orjson.dumps([row._asdict() for row in rows]), next_cursor)
+        set_cached_images(version, cache_key, cached)
     
-    return [
-        ImageResponseSchema.from_orm(img) for img in images
-    ]
+    body, next_cursor = cached
+    headers = {"Cache-Control": f"private, max-age={IMAGES_LIST_MAX_AGE}"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
 
-@app.get("/images/{image_id}")
-def get_image(image_id: int, db: Session = Depends(get_db)):
-    image = db.query(Image).filter(Image.id == image_id).first()
+@app.get("/images/{image_id}", response_model=ImageResponseSchema)
+async def get_image(image_id: int, db: AsyncSession = Depends(get_db)):
+    image = await query_image(db, image_id)
     if not image:
         raise HTTPException(status_code=404, detail="Imagen no encontrada")
-    return ImageResponseSchema.from_orm(image)
+    return image
 
 @app.post("/upload")
 async def upload_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     user_id: str = Form(None),
     description: str = Form(None),
@@ -264,40 +823,55 @@ async def upload_image(
     is_public: bool = Form(False),
     device_info: str = Form(None),
     app_version: str = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     # Validar tipo de archivo
-    allowed_mime_types = ["image/jpeg", "image/png", "image/gif", "image/webp", "image/jpg"]
-    if file.content_type not in allowed_mime_types:
+    if file.content_type not in ALLOWED_MIME_TYPES:
         raise HTTPException(status_code=400, detail="Tipo de archivo no permitido. Solo se permiten imágenes JPEG, PNG, GIF y WebP")
     
-    # Generar un nombre único para el archivo
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    
-    # Guardar el archivo
+    # Si ya existe una imagen con el mismo contenido se reutiliza su archivo
     try:
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        content_hash, existing = await find_duplicate_upload(db, file.file)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al guardar archivo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error en base de datos: {str(e)}")
     
-    # Procesar tags
-    tag_list = []
-    if tags:
-        tag_list = [tag.strip() for tag in tags.split(",")]
+    if existing:
+        unique_filename = existing.filename
+        file_size = existing.file_size
+        # Los archivos de la original pueden haber desaparecido (disco efímero)
+        try:
+            thumbnail_path = await run_in_threadpool(
+                restore_duplicate_files, file.file, unique_filename, existing.thumbnail_path
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error al guardar archivo: {str(e)}")
+    else:
+        thumbnail_path = None
+        # Generar un nombre único para el archivo
+        unique_filename = make_unique_filename(file.filename, file.content_type)
+        file_path = os.path.join(UPLOAD_DIR, unique_filename)
+        
+        # Guardar el archivo en un hilo para no bloquear el event loop
+        try:
+            file_size = await run_in_threadpool(save_upload_file, file.file, file_path)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error al guardar archivo: {str(e)}")
     
     # Crear registro en la base de datos con URL accesible
     db_image = Image(
         filename=unique_filename,
         original_filename=file.filename,
-        file_size=len(contents),
+        file_size=file_size,
         mime_type=file.content_type,
         file_path=f"/uploads/{unique_filename}",
+        thumbnail_path=thumbnail_path,
+        # Las dimensiones solo se calculan al generar la miniatura: una imagen
+        # duplicada las copia de la original
+        width=existing.width if existing else None,
+        height=existing.height if existing else None,
+        content_hash=content_hash,
         description=description,
-        tags=tag_list,
+        tags=parse_tags(tags),
         is_public=is_public,
         user_id=user_id,
         device_info=device_info,
@@ -305,83 +879,237 @@ async def upload_image(
     )
     
     try:
-        db.add(db_image)
-        db.commit()
-        db.refresh(db_image)
+        await save_image_record(db, db_image)
     except Exception as e:
-        # Eliminar archivo si hay error en la BD
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Eliminar archivo si hay error en la BD (solo si lo acabamos de escribir)
+        if not existing:
+            unlink_quiet(file_path)
         raise HTTPException(status_code=500, detail=f"Error en base de datos: {str(e)}")
     
+    invalidate_images_cache()
+    
+    # Un borrado concurrente de la original pudo apartar sus archivos entre la
+    # comprobación anterior y el INSERT; con la fila ya registrada ese borrado
+    # los devuelve a su sitio o esta comprobación los vuelve a escribir
+    if existing:
+        try:
+            thumbnail_path = await run_in_threadpool(
+                restore_duplicate_files, file.file, unique_filename, thumbnail_path
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error al guardar archivo: {str(e)}")
+    
+    # La miniatura se genera después de responder al cliente
+    if not thumbnail_path:
+        background_tasks.add_task(generate_thumbnail, db_image.id, unique_filename)
+    
     return {
         "message": "Imagen subida exitosamente",
         "image_id": db_image.id,
         "filename": unique_filename,
         "original_filename": file.filename,
         "file_url": f"/uploads/{unique_filename}",
-        "file_size": len(contents),
-        "upload_date": db_image.upload_date.isoformat()
+        "file_size": file_size,
+        "upload_date": db_image.upload_date
+    }
+
+@app.post("/upload-url")
+def create_upload_url(
+    filename: str = Form(...),
+    content_type: str = Form(...)
+):
+    """Devuelve una URL prefirmada de S3 para que el cliente suba la imagen directamente"""
+    if s3_client is None:
+        raise HTTPException(status_code=404, detail="La subida directa a S3 no está configurada")
+    
+    if content_type not in ALLOWED_MIME_TYPES:
+        raise HTTPException(status_code=400, detail="Tipo de archivo no permitido. Solo se permiten imágenes JPEG, PNG, GIF y WebP")
+    
+    key = f"uploads/{make_unique_filename(filename, content_type)}"
+    presigned = s3_client.generate_presigned_post(
+        S3_BUCKET,
+        key,
+        Fields={"Content-Type": content_type},
+        Conditions=[
+            {"Content-Type": content_type},
+            ["content-length-range", 1, S3_MAX_UPLOAD_SIZE]
+        ],
+        ExpiresIn=S3_UPLOAD_EXPIRES
+    )
+    
+    return {
+        "upload_url": presigned["url"],
+        "fields": presigned["fields"],
+        "key": key,
+        "expires_in": S3_UPLOAD_EXPIRES
+    }
+
+@app.post("/upload-finalize")
+async def finalize_upload(
+    key: str = Form(...),
+    original_filename: str = Form(...),
+    user_id: str = Form(None),
+    description: str = Form(None),
+    tags: str = Form(None),
+    is_public: bool = Form(False),
+    device_info: str = Form(None),
+    app_version: str = Form(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """Registra en la base de datos una imagen ya subida a S3 con /upload-url"""
+    if s3_client is None:
+        raise HTTPException(status_code=404, detail="La subida directa a S3 no está configurada")
+    
+    filename = key[len("uploads/"):]
+    if not key.startswith("uploads/") or not filename or "/" in filename:
+        raise HTTPException(status_code=400, detail="Clave de S3 no válida")
+    
+    # Una clave solo se registra una vez: borrar cualquiera de dos filas con la
+    # misma clave eliminaría de S3 el objeto que la otra sigue usando
+    file_url = f"{S3_PUBLIC_URL}/{key}"
+    if await db.scalar(select(Image.id).where(Image.file_path == file_url).limit(1)) is not None:
+        raise HTTPException(status_code=409, detail="La imagen ya está registrada")
+    
+    # Tamaño y tipo se toman del objeto ya subido, sin descargarlo
+    try:
+        head = await run_in_threadpool(s3_client.head_object, Bucket=S3_BUCKET, Key=key)
+    except ClientError:
+        raise HTTPException(status_code=404, detail="El archivo no existe en S3")
+    
+    db_image = Image(
+        filename=filename,
+        original_filename=original_filename,
+        file_size=head["ContentLength"],
+        mime_type=head["ContentType"],
+        file_path=file_url,
+        description=description,
+        tags=parse_tags(tags),
+        is_public=is_public,
+        user_id=user_id,
+        device_info=device_info,
+        app_version=app_version
+    )
+    
+    try:
+        await save_image_record(db, db_image)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en base de datos: {str(e)}")
+    
+    invalidate_images_cache()
+    
+    return {
+        "message": "Imagen subida exitosamente",
+        "image_id": db_image.id,
+        "filename": filename,
+        "original_filename": original_filename,
+        "file_url": file_url,
+        "file_size": db_image.file_size,
+        "upload_date": db_image.upload_date
     }
 
 @app.put("/images/{image_id}")
-def update_image(
+async def update_image(
     image_id: int,
     description: str = Form(None),
     tags: str = Form(None),
     is_public: bool = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    image = db.query(Image).filter(Image.id == image_id).first()
-    if not image:
-        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    values = {}
     
     if description is not None:
-        image.description = description
+        values["description"] = description
     
     if tags is not None:
-        image.tags = [tag.strip() for tag in tags.split(",")]
+        values["tags"] = parse_tags(tags)
     
     if is_public is not None:
-        image.is_public = is_public
+        values["is_public"] = is_public
+    
+    if values:
+        # Un solo UPDATE ... RETURNING en lugar de cargar la fila y luego actualizarla
+        stmt = update(Image).where(Image.id == image_id).values(**values).returning(Image)
+        image = (await db.execute(stmt)).scalar_one_or_none()
+        await db.commit()
+    else:
+        image = await query_image(db, image_id)
+    
+    if not image:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
     
-    db.commit()
-    db.refresh(image)
+    if values:
+        invalidate_images_cache()
     
     return {
         "message": "Imagen actualizada exitosamente",
-        "image": ImageResponseSchema.from_orm(image)
+        "image": ImageResponseSchema.model_validate(image)
     }
 
 @app.delete("/images/{image_id}")
-def delete_image(image_id: int, db: Session = Depends(get_db)):
-    image = db.query(Image).filter(Image.id == image_id).first()
-    if not image:
-        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+async def delete_image(image_id: int, db: AsyncSession = Depends(get_db)):
+    # Un solo DELETE ... RETURNING con las columnas necesarias para limpiar
+    # archivos: no se carga la fila completa solo para comprobar que existe
+    try:
+        deleted, paths, s3_keys = await delete_image_records(db, [image_id])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en base de datos: {str(e)}")
     
-    # Eliminar el archivo físico
-    physical_path = os.path.join(UPLOAD_DIR, image.filename)
-    if os.path.exists(physical_path):
-        os.remove(physical_path)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    invalidate_images_cache()
     
-    # Eliminar la miniatura si existe
-    if image.thumbnail_path:
-        thumbnail_filename = os.path.basename(image.thumbnail_path)
-        thumbnail_path = os.path.join(THUMBNAIL_DIR, thumbnail_filename)
-        if os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
+    # Eliminar el archivo físico y la miniatura (si ninguna otra imagen los usa)
+    for path in paths:
+        await run_in_threadpool(unlink_quiet, path)
     
-    # Eliminar el registro de la base de datos
-    db.delete(image)
-    db.commit()
+    # Eliminar el objeto de S3 si la imagen se subió directamente al bucket
+    # (la fila ya no existe: un fallo de S3 solo se registra en el log)
+    for key in s3_keys:
+        try:
+            await run_in_threadpool(s3_client.delete_object, Bucket=S3_BUCKET, Key=key)
+        except ClientError as e:
+            print(f"❌ Error eliminando {key} de S3: {e}")
     
     return {"message": "Imagen eliminada exitosamente"}
 
+@app.post("/images/bulk_delete")
+async def bulk_delete_images(payload: BulkDeleteSchema, db: AsyncSession = Depends(get_db)):
+    """Endpoint para eliminar varias imágenes en una sola petición"""
+    if len(payload.ids) > BULK_DELETE_MAX:
+        raise HTTPException(status_code=400, detail=f"Se pueden eliminar como máximo {BULK_DELETE_MAX} imágenes por petición")
+    
+    if not payload.ids:
+        return {"message": "Imágenes eliminadas exitosamente", "deleted": 0}
+    
+    try:
+        deleted, paths, s3_keys = await delete_image_records(db, payload.ids)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error en base de datos: {str(e)}")
+    
+    invalidate_images_cache()
+    
+    # Eliminar los archivos físicos en paralelo
+    await asyncio.gather(*(run_in_threadpool(unlink_quiet, path) for path in paths))
+    if s3_keys:
+        try:
+            await run_in_threadpool(
+                s3_client.delete_objects,
+                Bucket=S3_BUCKET,
+                Delete={"Objects": [{"Key": key} for key in s3_keys], "Quiet": True}
+            )
+        except ClientError as e:
+            print(f"❌ Error eliminando {len(s3_keys)} objetos de S3: {e}")
+    
+    return {"message": "Imágenes eliminadas exitosamente", "deleted": deleted}
+
 # Ejecutar la aplicación
 if __name__ == "__main__":
     import uvicorn
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # Los workers heredan el entorno y calculan su parte del pool con este valor
+    os.environ["WEB_CONCURRENCY"] = str(workers)
     
     print("=" * 50)
     print("🚀 Iniciando Photo Picker API")
@@ -391,7 +1119,10 @@ if __name__ == "__main__":
     print(f"👤 Usuario: {DB_USER}")
     print(f"🔒 SSL Mode: disabled")
     print(f"📁 Directorio uploads: {UPLOAD_DIR}")
-    print(f"🔗 URL de conexión: postgresql://{DB_USER}:******@{DB_HOST}:{DB_PORT}/{DB_NAME}?sslmode=disable")
+    print(f"⚙️  Workers: {workers}")
+    print(f"🔗 URL de conexión: {DATABASE_URL_MASKED}")
     print("=" * 50)
     
-    uvicorn.run(app, host=host, port=port)
\ No newline at end of file
+    # loop y http quedan en "auto": uvicorn usa uvloop/httptools si están
+    # instalados (uvicorn[standard] no instala uvloop en Windows)
+    uvicorn.run("main:app", host=host, port=port, workers=workers)
\ No newline at end of file
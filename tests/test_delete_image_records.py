@@ -0,0 +1,123 @@
+import asyncio
+import io
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+# main.py crea el engine y los directorios al importarse: apuntarlo a un
+# servidor inexistente y a un directorio temporal antes de importarlo
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("DB_HOST", "127.0.0.1")
+os.environ.setdefault("DB_PORT", "1")
+os.environ["UPLOAD_DIR"] = os.path.join(_tmp, "uploads")
+os.environ["THUMBNAIL_DIR"] = os.path.join(_tmp, "thumbnails")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import main
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """Sesión mínima: el DELETE devuelve `rows` y cada consulta de archivos en
+    uso responde con el siguiente conjunto de `in_use`"""
+
+    def __init__(self, rows, in_use):
+        self.rows = rows
+        self.in_use = list(in_use)
+        self.on_query = []
+
+    async def execute(self, stmt):
+        return FakeResult(self.rows)
+
+    async def commit(self):
+        pass
+
+    async def scalars(self, stmt):
+        # Comprobar el disco en el momento de la consulta
+        for callback in self.on_query:
+            callback()
+        return iter(self.in_use.pop(0))
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    upload_dir = tmp_path / "uploads"
+    thumbnail_dir = tmp_path / "thumbnails"
+    upload_dir.mkdir()
+    thumbnail_dir.mkdir()
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(upload_dir))
+    monkeypatch.setattr(main, "THUMBNAIL_DIR", str(thumbnail_dir))
+    (upload_dir / "a.jpg").write_bytes(b"imagen")
+    (thumbnail_dir / "a.jpg").write_bytes(b"miniatura")
+    return upload_dir, thumbnail_dir
+
+
+def deleted_row():
+    return SimpleNamespace(filename="a.jpg", file_path="/uploads/a.jpg", thumbnail_path="/thumbnails/a.jpg")
+
+
+def test_shared_file_is_never_moved(files):
+    upload_dir, _ = files
+    db = FakeSession([deleted_row()], in_use=[{"a.jpg"}])
+    db.on_query.append(lambda: assert_exists(upload_dir / "a.jpg"))
+
+    deleted, paths, s3_keys = asyncio.run(main.delete_image_records(db, [1]))
+
+    assert (deleted, paths, s3_keys) == (1, [], [])
+    assert sorted(os.listdir(upload_dir)) == ["a.jpg"]
+    # Solo se hizo la primera comprobación
+    assert db.in_use == []
+
+
+def test_file_referenced_after_stashing_is_restored(files):
+    upload_dir, thumbnail_dir = files
+    # Una subida duplicada se registra entre las dos comprobaciones
+    db = FakeSession([deleted_row()], in_use=[set(), {"a.jpg"}])
+
+    deleted, paths, _ = asyncio.run(main.delete_image_records(db, [1]))
+
+    assert deleted == 1
+    assert paths == []
+    assert sorted(os.listdir(upload_dir)) == ["a.jpg"]
+    assert sorted(os.listdir(thumbnail_dir)) == ["a.jpg"]
+
+
+def test_unused_file_is_returned_for_cleanup(files):
+    upload_dir, thumbnail_dir = files
+    db = FakeSession([deleted_row()], in_use=[set(), set()])
+
+    _, paths, _ = asyncio.run(main.delete_image_records(db, [1]))
+
+    assert len(paths) == 2
+    assert not (upload_dir / "a.jpg").exists()
+    assert not (thumbnail_dir / "a.jpg").exists()
+    assert all(os.path.exists(path) and path.endswith(".deleted") for path in paths)
+
+
+def test_duplicate_registered_after_delete_rewrites_file(files):
+    upload_dir, thumbnail_dir = files
+    db = FakeSession([deleted_row()], in_use=[set(), set()])
+    _, paths, _ = asyncio.run(main.delete_image_records(db, [1]))
+    for path in paths:
+        main.unlink_quiet(path)
+
+    # La subida duplicada se registró después de la segunda comprobación
+    thumbnail = main.restore_duplicate_files(io.BytesIO(b"imagen"), "a.jpg", "/thumbnails/a.jpg")
+
+    assert (upload_dir / "a.jpg").read_bytes() == b"imagen"
+    # La miniatura también falta: hay que regenerarla
+    assert thumbnail is None
+
+
+def assert_exists(path):
+    assert path.exists()